@@ -1,74 +1,406 @@
 import mysql.connector
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import sys
+import argparse
+import getpass
 import csv
+import gzip
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
-while True:
+# Shared connection used by the menus; set up by connect_as_root()
+conn = None
+cursor = None
+mysql_password = None
+
+# === Connection management ===
+# Connections opened with open_connection() are pinged after sitting idle,
+# reconnected with backoff when the server has dropped them, and carry
+# session limits so a stuck statement cannot hang a counter forever.
+IDLE_PING_SECONDS = 30
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8
+RECONNECT_DEADLINE_SECONDS = 20    # give up reconnecting after this, whatever is left of the attempts
+CONNECT_TIMEOUT_SECONDS = 5        # establishing a connection
+STATEMENT_TIMEOUT_MS = 10000       # MAX_EXECUTION_TIME for SELECTs
+REPORT_TIMEOUT_MS = 30000          # longest per-statement hint, see STATEMENT_TIMEOUTS_MS
+# Waiting on a reply. Longer than any server-side limit, so a slow statement is
+# stopped by the server with an error instead of looking like a lost connection.
+SOCKET_TIMEOUT_SECONDS = REPORT_TIMEOUT_MS // 1000 + 15
+LOCK_WAIT_TIMEOUT_SECONDS = 10     # innodb_lock_wait_timeout for writes
+CONNECTION_LOST_ERRORS = {2006, 2013, 2055}   # server gone away / lost connection
+
+# id(connection) -> {"database", "isolation", "last_used", "dirty"}
+_connection_state = {}
+
+def _init_session(connection, state):
+    if state["database"]:
+        connection.database = state["database"]
+    session_cursor = connection.cursor()
+    session_cursor.execute(f"SET SESSION max_execution_time = {STATEMENT_TIMEOUT_MS}")
+    session_cursor.execute(f"SET SESSION innodb_lock_wait_timeout = {LOCK_WAIT_TIMEOUT_SECONDS}")
+    if state["isolation"]:
+        session_cursor.execute(f"SET SESSION TRANSACTION ISOLATION LEVEL {state['isolation']}")
+    session_cursor.close()
+    state["last_used"] = time.monotonic()
+    state["dirty"] = False
+
+def manage_connection(connection, database=None, isolation=None):
+    """Put a connection under health checks and session limits."""
+    state = {"database": database, "isolation": isolation, "last_used": 0.0, "dirty": False}
+    _init_session(connection, state)
+    _connection_state[id(connection)] = state
+
+def open_connection(password, host="localhost", port=3306, user="root",
+                    database=None, isolation=None, autocommit=False):
+    options = {"host": host, "port": port, "user": user, "password": password,
+               "connection_timeout": CONNECT_TIMEOUT_SECONDS,
+               "read_timeout": SOCKET_TIMEOUT_SECONDS, "write_timeout": SOCKET_TIMEOUT_SECONDS}
+    if database:
+        options["database"] = database
     try:
-        # === Ask for MySQL root password (for Database setup) ===
-        mysql_password = input("Enter MySQL root password: ")
+        connection = mysql.connector.connect(**options)
+    except AttributeError:
+        # Connector/Python without read_timeout/write_timeout. Its C extension applies
+        # connection_timeout to connecting only; the pure-Python one also to every read.
+        del options["read_timeout"], options["write_timeout"]
+        options.update(connection_timeout=SOCKET_TIMEOUT_SECONDS, use_pure=True)
+        connection = mysql.connector.connect(**options)
+    connection.autocommit = autocommit
+    manage_connection(connection, database, isolation)
+    return connection
+
+def reconnect(connection):
+    """Reopen a dropped connection in place, backing off between attempts.
+
+    Gives up after RECONNECT_ATTEMPTS or once RECONNECT_DEADLINE_SECONDS have passed.
+    """
+    state = _connection_state[id(connection)]
+    deadline = time.monotonic() + RECONNECT_DEADLINE_SECONDS
+    delay = RECONNECT_BASE_DELAY
+    for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+        try:
+            connection.reconnect(attempts=1, delay=0)
+            # The new session gets a new connection id, so prepared statements re-prepare
+            _init_session(connection, state)
+            return
+        except mysql.connector.Error:
+            if attempt == RECONNECT_ATTEMPTS or time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+def check_connection(connection):
+    """Ping a connection that has been idle, reconnecting if the server dropped it.
+
+    A connection holding uncommitted writes is left alone: reconnecting would
+    silently discard them, so the next statement reports the loss instead.
+    """
+    state = _connection_state.get(id(connection))
+    if not state or state["dirty"] or time.monotonic() - state["last_used"] < IDLE_PING_SECONDS:
+        return
+    try:
+        connection.ping(reconnect=False)
+    except mysql.connector.Error:
+        reconnect(connection)
 
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password=mysql_password
-        )
-        cursor = conn.cursor()
-        print("Connected to MySQL as root.")
-        break   # success → exit loop
+def discard_connection(connection):
+    """Close a connection that is being given up on and forget its session state."""
+    try:
+        connection.close()
+    except mysql.connector.Error:
+        pass
+    _connection_state.pop(id(connection), None)
+    _prepared_cursors.pop(id(connection), None)
+
+def commit(connection=None):
+    connection = connection or conn
+    connection.commit()
+    state = _connection_state.get(id(connection))
+    if state:
+        state["dirty"] = False
+
+def rollback(connection=None):
+    connection = connection or conn
+    try:
+        connection.rollback()
+    except mysql.connector.Error:
+        # Connection already lost: the server has discarded the transaction anyway
+        pass
+    state = _connection_state.get(id(connection))
+    if state:
+        state["dirty"] = False
+
+def connect_as_root():
+    global conn, cursor, mysql_password
+    while True:
+        try:
+            # === Ask for MySQL root password (for Database setup) ===
+            mysql_password = input("Enter MySQL root password: ")
 
-    except KeyboardInterrupt:
-        print("\nLogin cancelled by user. Exiting...")
-        exit(0)
+            conn = open_connection(mysql_password)
+            cursor = conn.cursor()
+            print("Connected to MySQL as root.")
+            return   # success
 
+        except KeyboardInterrupt:
+            print("\nLogin cancelled by user. Exiting...")
+            exit(0)
+
+        except mysql.connector.Error as e:
+            if e.errno == 1045:
+                print("Wrong password. Try again.\n")
+            else:
+                print(f"MySQL error: {e}")
+                exit(1)
+
+# === Read replica (optional) ===
+# Set IMS_REPLICA_HOST to send listings and reports to a read replica. Writes
+# and read-your-writes paths (checkout validation, edit fetch) stay on conn.
+REPLICA_HOST = os.environ.get("IMS_REPLICA_HOST")
+REPLICA_PORT = int(os.environ.get("IMS_REPLICA_PORT", "3306"))
+REPLICA_USER = os.environ.get("IMS_REPLICA_USER", "root")
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("IMS_REPLICA_MAX_LAG", "5"))
+# A server that is not replicating reports no lag at all. With IMS_REPLICA_STANDIN=1
+# such a server is treated as current, for testing against a hand-seeded second mysqld.
+REPLICA_STANDIN = os.environ.get("IMS_REPLICA_STANDIN") == "1"
+REPLICA_LAG_CHECK_SECONDS = 2
+
+replica_conn = None
+_replica_lag = None
+_replica_lag_checked_at = 0.0
+
+def connect_replica():
+    global replica_conn
+    if not REPLICA_HOST:
+        return
+    try:
+        # Autocommit: the replica is only read, and without it every listing after the
+        # first would come from the same REPEATABLE READ snapshot and never advance
+        replica_conn = open_connection(
+            os.environ.get("IMS_REPLICA_PASSWORD", mysql_password),
+            host=REPLICA_HOST,
+            port=REPLICA_PORT,
+            user=REPLICA_USER,
+            database="inventory_db",
+            autocommit=True
+        )
+        print(f"Connected to read replica at {REPLICA_HOST}:{REPLICA_PORT}.")
     except mysql.connector.Error as e:
-        if e.errno == 1045:
-            print("Wrong password. Try again.\n")
-        else:
-            print(f"MySQL error: {e}")
-            exit(1)
+        print(f"Read replica unavailable, using primary for all reads: {e}")
+        replica_conn = None
+
+def replica_lag():
+    """Seconds the replica is behind the primary, or None if unknown. Cached briefly."""
+    global _replica_lag, _replica_lag_checked_at
+    if time.monotonic() - _replica_lag_checked_at < REPLICA_LAG_CHECK_SECONDS:
+        return _replica_lag
+
+    lag = None
+    try:
+        status_cursor = replica_conn.cursor(dictionary=True)
+        try:
+            try:
+                status_cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                # MySQL before 8.0.22 only knows the old name
+                status_cursor.execute("SHOW SLAVE STATUS")
+            # One row per replication channel; the first is the default channel
+            rows = status_cursor.fetchall()
+        finally:
+            status_cursor.close()
+        status = rows[0] if rows else None
+        if status:
+            lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        elif REPLICA_STANDIN:
+            lag = 0
+    except mysql.connector.Error:
+        lag = None
+        # One quick attempt per check; reads use the primary meanwhile
+        try:
+            replica_conn.reconnect(attempts=1, delay=0)
+            _init_session(replica_conn, _connection_state[id(replica_conn)])
+        except mysql.connector.Error:
+            pass
+
+    _replica_lag = lag
+    _replica_lag_checked_at = time.monotonic()
+    return lag
+
+def read_connection():
+    """Replica if it is up and within the lag threshold, otherwise the primary."""
+    if replica_conn is None:
+        return conn
+    lag = replica_lag()
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+        return conn
+    return replica_conn
+
+def run_read_statement(name, params=(), fetch="all"):
+    """run_statement for listings and reports: replica first, primary if the replica fails."""
+    global _replica_lag, _replica_lag_checked_at
+    connection = read_connection()
+    if connection is conn:
+        return run_statement(name, params, fetch)
+    try:
+        # No ping, reconnect or retry here: the primary answers at once instead,
+        # and the next lag check reconnects the replica
+        return run_statement(name, params, fetch, connection=connection, recover=False)
+    except mysql.connector.Error:
+        # Stay on the primary until the next lag check
+        _replica_lag = None
+        _replica_lag_checked_at = time.monotonic()
+        return run_statement(name, params, fetch)
+
+def close_connections():
+    cursor.close()
+    conn.close()
+    if replica_conn is not None:
+        replica_conn.close()
 
 # === Database and tables ===
-cursor.execute("CREATE DATABASE IF NOT EXISTS inventory_db")
-conn.database = "inventory_db"
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    username VARCHAR(255) UNIQUE,
-    password VARCHAR(255) COLLATE utf8mb4_bin
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS suppliers (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT,
-    supplier_name VARCHAR(255),
-    supplier_phone VARCHAR(20),
-    supplier_address TEXT,
-    UNIQUE(user_id, supplier_name),
-    FOREIGN KEY (user_id) REFERENCES users(id)
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS inventory (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT,
-    supplier_id INT,
-    name VARCHAR(255),
-    quantity INT,
-    price DECIMAL(10,2),
-    supplier_price DECIMAL(10,2),
-    gst_percent DECIMAL(5,2),
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
-)
-""")
-conn.commit()
+def create_schema(db_cursor, connection, database="inventory_db"):
+    db_cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+    connection.database = database
+
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(255) UNIQUE,
+        password VARCHAR(255) COLLATE utf8mb4_bin
+    )
+    """)
+
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS suppliers (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT,
+        supplier_name VARCHAR(255),
+        supplier_phone VARCHAR(20),
+        supplier_address TEXT,
+        UNIQUE(user_id, supplier_name),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS inventory (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT,
+        supplier_id INT,
+        name VARCHAR(255),
+        quantity INT,
+        price DECIMAL(10,2),
+        supplier_price DECIMAL(10,2),
+        gst_percent DECIMAL(5,2),
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+    )
+    """)
+
+    # Append-only stock ledger. inventory.quantity holds the last compacted
+    # snapshot; rows with compacted=0 are the tail not yet folded into it.
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT,
+        item_id INT,
+        movement_type ENUM('receipt', 'sale', 'adjustment', 'delete'),
+        qty_change INT,
+        compacted TINYINT(1) DEFAULT 0,
+        created_at DATETIME(6) DEFAULT CURRENT_TIMESTAMP(6),
+        INDEX idx_movements_tail (item_id, compacted),
+        INDEX idx_movements_pending (compacted, id),
+        INDEX idx_movements_item_time (user_id, item_id, created_at),
+        INDEX idx_movements_user_time (user_id, created_at),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    # Opening balance for items created before the ledger existed, so that
+    # point-in-time queries can sum the ledger from the beginning.
+    db_cursor.execute("""
+    INSERT INTO stock_movements (user_id, item_id, movement_type, qty_change, compacted)
+    SELECT i.user_id, i.id, 'adjustment', i.quantity, 1
+    FROM inventory i
+    WHERE NOT EXISTS (SELECT 1 FROM stock_movements m WHERE m.item_id = i.id)
+    """)
+
+    # Change feed for downstream sync. Writers only append to change_pending;
+    # the change sequencer moves committed events into change_log with the
+    # next per-user seq from change_seq. Seqs are handed out after commit, so
+    # an event that commits late still gets a seq above everything already
+    # streamed, and no writer holds a per-user lock.
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_pending (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT,
+        entity ENUM('inventory', 'supplier', 'bill'),
+        entity_id VARCHAR(64),
+        operation ENUM('insert', 'update', 'delete'),
+        payload JSON,
+        created_at DATETIME(6) DEFAULT CURRENT_TIMESTAMP(6),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_seq (
+        user_id INT PRIMARY KEY,
+        seq BIGINT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        user_id INT,
+        seq BIGINT,
+        entity ENUM('inventory', 'supplier', 'bill'),
+        entity_id VARCHAR(64),
+        operation ENUM('insert', 'update', 'delete'),
+        payload JSON,
+        created_at DATETIME(6) DEFAULT CURRENT_TIMESTAMP(6),
+        PRIMARY KEY (user_id, seq),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    # Dashboard figures, kept current by each stock change and checkout. Each
+    # user's totals are spread over SUMMARY_SLOTS rows and summed on read.
+    # A table from before it had slots keeps its one row per user as slot 0.
+    db_cursor.execute("SHOW TABLES LIKE 'user_summary'")
+    if db_cursor.fetchall():
+        db_cursor.execute("SHOW COLUMNS FROM user_summary LIKE 'slot'")
+        if not db_cursor.fetchall():
+            db_cursor.execute(
+                "ALTER TABLE user_summary ADD COLUMN slot TINYINT NOT NULL DEFAULT 0 AFTER user_id, "
+                "DROP PRIMARY KEY, ADD PRIMARY KEY (user_id, slot)"
+            )
+    db_cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INT,
+        slot TINYINT NOT NULL,
+        item_count INT NOT NULL DEFAULT 0,
+        stock_value_cost DECIMAL(14,2) NOT NULL DEFAULT 0,
+        stock_value_retail DECIMAL(14,2) NOT NULL DEFAULT 0,
+        sales_date DATE,
+        sales_today DECIMAL(14,2) NOT NULL DEFAULT 0,
+        gst_today DECIMAL(14,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, slot),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    connection.commit()
 
 # === Users data folder ===
 users_data_dir = os.path.join(base_dir, "users_data")
@@ -83,6 +415,832 @@ def ensure_user_folder(username: str) -> str:
     os.makedirs(folder_path, exist_ok=True)
     return folder_path
 
+# === Billing engine ===
+# Money is integer paise and rates are integer basis points (1% = 100), so
+# bills, CSV history and reports all agree to the paisa. Rounding policy:
+# a line's discount and GST are each rounded half-up to the paisa; bill
+# totals are exact sums of the rounded lines and are never rounded again.
+def to_paise(amount) -> int:
+    """Rupees (number, Decimal or text such as a CSV cell) to integer paise."""
+    if amount in (None, ""):
+        return 0
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_basis_points(percent) -> int:
+    return to_paise(percent)  # same scale: hundredths
+
+def format_rupees(paise: int) -> str:
+    sign = "-" if paise < 0 else ""
+    return f"{sign}{abs(paise) // 100}.{abs(paise) % 100:02d}"
+
+def format_percent(basis_points: int) -> str:
+    return format_rupees(basis_points)
+
+def _share(amount: int, basis_points: int) -> int:
+    """amount * basis_points / 10000, rounded half-up, in integers only."""
+    quotient, remainder = divmod(amount * basis_points, 10000)
+    return quotient + (1 if remainder * 2 >= 10000 else 0)
+
+def compute_bill(bill_items, discount_bp):
+    """Price every line of a bill in one pass. Returns the bill totals in paise.
+
+    Each item needs "qty", "price" (paise) and "gst_bp"; "base", "discount",
+    "discounted", "gst" and "final" are filled in, all in paise.
+    """
+    totals = {"base": 0, "discount": 0, "discounted": 0, "gst": 0, "final": 0}
+    for item in bill_items:
+        base = item["qty"] * item["price"]
+        discount = _share(base, discount_bp)
+        discounted = base - discount
+        gst = _share(discounted, item["gst_bp"])
+
+        item["base"] = base
+        item["discount"] = discount
+        item["discounted"] = discounted
+        item["gst"] = gst
+        item["final"] = discounted + gst
+        for key in totals:
+            totals[key] += item[key]
+    return totals
+
+def sales_row_amounts(row):
+    """Paise amounts of one bill_history.csv row: (cost, discounted, gst, final)."""
+    return (
+        to_paise(row["Supplier Price"]) * int(row["Quantity"] or 0),
+        to_paise(row["Discounted Price"]),
+        to_paise(row["GST Amount"]),
+        to_paise(row["Final Price (after GST)"])
+    )
+
+# === Statement registry ===
+# Current quantity = compacted snapshot + uncompacted ledger tail.
+# Use with the inventory table aliased as "i".
+CURRENT_QTY_SQL = (
+    "CAST(i.quantity + COALESCE((SELECT SUM(m.qty_change) FROM stock_movements m "
+    "WHERE m.item_id = i.id AND m.compacted = 0), 0) AS SIGNED)"
+)
+
+# Every query the app runs after startup, by name. Each one is a server-side
+# prepared statement, prepared once per connection and then reused.
+STATEMENTS = {
+    # users
+    "user_login": "SELECT id FROM users WHERE username=%s AND password=%s",
+    "user_insert": "INSERT INTO users (username, password) VALUES (%s, %s)",
+    "user_id_by_name": "SELECT id FROM users WHERE username=%s",
+
+    # suppliers
+    "supplier_insert": (
+        "INSERT INTO suppliers (user_id, supplier_name, supplier_phone, supplier_address) "
+        "VALUES (%s, %s, %s, %s)"
+    ),
+    "supplier_choices": "SELECT id, supplier_name FROM suppliers WHERE user_id=%s ORDER BY id ASC",
+    "supplier_list": "SELECT id, supplier_name, supplier_phone, supplier_address FROM suppliers WHERE user_id=%s",
+
+    # inventory
+    "item_merge_lookup": (
+        f"SELECT i.id, {CURRENT_QTY_SQL}, i.supplier_price FROM inventory i "
+        "WHERE i.user_id=%s AND i.name=%s AND i.price=%s AND i.gst_percent=%s AND i.supplier_id=%s"
+    ),
+    "item_insert": (
+        "INSERT INTO inventory (user_id, supplier_id, name, quantity, price, supplier_price, gst_percent) "
+        "VALUES (%s, %s, %s, 0, %s, %s, %s)"
+    ),
+    "item_set_supplier_price": "UPDATE inventory SET supplier_price=%s WHERE id=%s",
+    "item_update_details": (
+        "UPDATE inventory SET price=%s, gst_percent=%s, supplier_price=%s WHERE id=%s AND user_id=%s"
+    ),
+    "item_delete": "DELETE FROM inventory WHERE id=%s AND user_id=%s",
+    "item_for_delete": (
+        "SELECT name, price, supplier_price, gst_percent, supplier_id FROM inventory WHERE id=%s AND user_id=%s"
+    ),
+    "item_quantity": f"SELECT {CURRENT_QTY_SQL} FROM inventory i WHERE i.id=%s AND i.user_id=%s",
+    "item_lock": "SELECT id FROM inventory WHERE id=%s AND user_id=%s FOR UPDATE",
+    "item_for_edit": (
+        f"SELECT i.name, {CURRENT_QTY_SQL}, i.price, i.gst_percent, i.supplier_price, i.supplier_id "
+        "FROM inventory i WHERE i.id=%s AND i.user_id=%s"
+    ),
+    "item_for_bill": (
+        f"SELECT i.id, i.name, {CURRENT_QTY_SQL}, i.price, i.gst_percent, i.supplier_price "
+        "FROM inventory i WHERE i.id=%s AND i.user_id=%s"
+    ),
+    "stock_list": (
+        f"SELECT i.id, i.name, {CURRENT_QTY_SQL}, i.price, i.gst_percent, s.supplier_name, i.supplier_price "
+        "FROM inventory i LEFT JOIN suppliers s ON i.supplier_id = s.id WHERE i.user_id=%s"
+    ),
+    "item_apply_delta": "UPDATE inventory SET quantity = quantity + %s WHERE id=%s",
+
+    # stock ledger
+    "movement_insert": (
+        "INSERT INTO stock_movements (user_id, item_id, movement_type, qty_change) VALUES (%s, %s, %s, %s)"
+    ),
+    "movement_pending": (
+        "SELECT id, item_id, qty_change FROM stock_movements WHERE compacted = 0 ORDER BY id LIMIT %s FOR UPDATE"
+    ),
+    "movement_mark_compacted": "UPDATE stock_movements SET compacted = 1 WHERE id=%s",
+    "movements_by_user": (
+        "SELECT id, item_id, movement_type, qty_change, created_at FROM stock_movements "
+        "WHERE user_id=%s AND created_at BETWEEN %s AND %s ORDER BY created_at, id"
+    ),
+    "movements_by_item": (
+        "SELECT id, item_id, movement_type, qty_change, created_at FROM stock_movements "
+        "WHERE user_id=%s AND item_id=%s AND created_at BETWEEN %s AND %s ORDER BY created_at, id"
+    ),
+    "stock_as_of": (
+        "SELECT CAST(COALESCE(SUM(qty_change), 0) AS SIGNED) FROM stock_movements "
+        "WHERE user_id=%s AND item_id=%s AND created_at <= %s"
+    ),
+
+    # dashboard summary
+    # No row when the user has no summary yet (GROUP BY, not a bare aggregate)
+    "summary_get": (
+        "SELECT SUM(item_count), SUM(stock_value_cost), SUM(stock_value_retail), "
+        "SUM(IF(sales_date = CURDATE(), sales_today, 0)), SUM(IF(sales_date = CURDATE(), gst_today, 0)) "
+        "FROM user_summary WHERE user_id=%s GROUP BY user_id"
+    ),
+    "summary_lock": "SELECT slot FROM user_summary WHERE user_id=%s FOR UPDATE",
+    "summary_apply": (
+        "INSERT INTO user_summary "
+        "(user_id, slot, item_count, stock_value_cost, stock_value_retail, sales_date, sales_today, gst_today) "
+        "VALUES (%s, %s, %s, %s, %s, CURDATE(), %s, %s) "
+        "ON DUPLICATE KEY UPDATE "
+        "item_count = item_count + %s, "
+        "stock_value_cost = stock_value_cost + %s, "
+        "stock_value_retail = stock_value_retail + %s, "
+        "sales_today = IF(sales_date = CURDATE(), sales_today, 0) + %s, "
+        "gst_today = IF(sales_date = CURDATE(), gst_today, 0) + %s, "
+        "sales_date = CURDATE()"
+    ),
+    "summary_replace": (
+        "INSERT INTO user_summary "
+        "(user_id, slot, item_count, stock_value_cost, stock_value_retail, sales_date, sales_today, gst_today) "
+        "VALUES (%s, 0, %s, %s, %s, CURDATE(), %s, %s) "
+        "ON DUPLICATE KEY UPDATE "
+        "item_count = %s, stock_value_cost = %s, stock_value_retail = %s, "
+        "sales_date = CURDATE(), sales_today = %s, gst_today = %s"
+    ),
+    "summary_clear_slots": (
+        "UPDATE user_summary SET item_count = 0, stock_value_cost = 0, stock_value_retail = 0, "
+        "sales_date = CURDATE(), sales_today = 0, gst_today = 0 WHERE user_id=%s AND slot <> 0"
+    ),
+    "summary_stock_from_source": (
+        "SELECT COUNT(*), COALESCE(SUM(q.qty * q.supplier_price), 0), COALESCE(SUM(q.qty * q.price), 0) "
+        f"FROM (SELECT {CURRENT_QTY_SQL} AS qty, i.supplier_price, i.price FROM inventory i WHERE i.user_id=%s) q"
+    ),
+
+    # change feed
+    "change_pending_insert": (
+        "INSERT INTO change_pending (user_id, entity, entity_id, operation, payload) "
+        "VALUES (%s, %s, %s, %s, %s)"
+    ),
+    "change_pending_batch": "SELECT id, user_id FROM change_pending ORDER BY id LIMIT %s",
+    "change_pending_delete": "DELETE FROM change_pending WHERE id=%s",
+    "change_seq_reserve": (
+        "INSERT INTO change_seq (user_id, seq) VALUES (%s, LAST_INSERT_ID(%s)) "
+        "ON DUPLICATE KEY UPDATE seq = LAST_INSERT_ID(seq + %s)"
+    ),
+    "change_insert_from_pending": (
+        "INSERT INTO change_log (user_id, seq, entity, entity_id, operation, payload, created_at) "
+        "SELECT user_id, %s, entity, entity_id, operation, payload, created_at FROM change_pending WHERE id=%s"
+    ),
+    "sequencer_lock": "SELECT GET_LOCK('ims_change_sequencer', 0)",
+    "sequencer_unlock": "SELECT RELEASE_LOCK('ims_change_sequencer')",
+    "change_feed": (
+        "SELECT seq, entity, entity_id, operation, payload, created_at FROM change_log "
+        "WHERE user_id=%s AND seq > %s ORDER BY seq LIMIT %s"
+    ),
+}
+
+# Heavier reports get more time than the session-wide STATEMENT_TIMEOUT_MS
+STATEMENT_TIMEOUTS_MS = {
+    "stock_list": 20000,
+    "movements_by_user": REPORT_TIMEOUT_MS,
+    "movements_by_item": REPORT_TIMEOUT_MS,
+    "stock_as_of": REPORT_TIMEOUT_MS,
+    "summary_stock_from_source": REPORT_TIMEOUT_MS,
+}
+for _name, _timeout_ms in STATEMENT_TIMEOUTS_MS.items():
+    STATEMENTS[_name] = STATEMENTS[_name].replace("SELECT", f"SELECT /*+ MAX_EXECUTION_TIME({_timeout_ms}) */", 1)
+
+# Plain reads can be re-run after a reconnect; anything else may already have taken effect
+IDEMPOTENT_STATEMENTS = {
+    name for name, sql in STATEMENTS.items()
+    if sql.lstrip().upper().startswith("SELECT") and "FOR UPDATE" not in sql.upper()
+}
+
+# name -> [executions, total seconds, slowest seconds]
+statement_stats = {name: [0, 0.0, 0.0] for name in STATEMENTS}
+_stats_lock = threading.Lock()
+
+# id(connection) -> (server connection id, {statement name: prepared cursor})
+_prepared_cursors = {}
+
+def _prepared_cursor(name, connection):
+    key = id(connection)
+    session_id = connection.connection_id
+    cached = _prepared_cursors.get(key)
+    if cached is None or cached[0] != session_id:
+        # New connection or a reconnect: handles from the old session are gone
+        cached = (session_id, {})
+        _prepared_cursors[key] = cached
+    cursors = cached[1]
+    if name not in cursors:
+        cursors[name] = connection.cursor(prepared=True)
+    return cursors[name]
+
+def run_statement(name, params=(), fetch=None, connection=None, retry=True, recover=True):
+    """Execute a registered statement.
+
+    fetch is None (returns the cursor, for lastrowid/rowcount), "one" or "all".
+    With recover=False a lost connection is raised straight away, without the
+    idle ping, reconnect or retry.
+    """
+    connection = connection or conn
+    if recover:
+        check_connection(connection)
+    state = _connection_state.get(id(connection))
+    db_cursor = _prepared_cursor(name, connection)
+    started = time.perf_counter()
+    try:
+        db_cursor.execute(STATEMENTS[name], params)
+        if fetch == "one":
+            # Drain the result set so the connection is free for the next statement
+            rows = db_cursor.fetchall()
+            result = rows[0] if rows else None
+        elif fetch == "all":
+            result = db_cursor.fetchall()
+        else:
+            result = db_cursor
+    except mysql.connector.Error as e:
+        # Force a fresh prepare next time in case the handle went bad
+        _prepared_cursors.get(id(connection), (None, {}))[1].pop(name, None)
+        if state is None or not recover or e.errno not in CONNECTION_LOST_ERRORS:
+            raise
+        lost_writes = state["dirty"]
+        # Gave up waiting on the reply: running it again would only wait again
+        timed_out = time.perf_counter() - started >= SOCKET_TIMEOUT_SECONDS
+        reconnect(connection)
+        # Only a read outside a write transaction is safe to run again
+        if retry and name in IDEMPOTENT_STATEMENTS and not lost_writes and not timed_out:
+            return run_statement(name, params, fetch, connection, retry=False)
+        raise
+    elapsed = time.perf_counter() - started
+
+    if state is not None:
+        state["last_used"] = time.monotonic()
+        if name not in IDEMPOTENT_STATEMENTS:
+            state["dirty"] = True
+
+    with _stats_lock:
+        stats = statement_stats[name]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+    return result
+
+def view_statement_stats():
+    print("\n=== STATEMENT STATS ===")
+    used = [(name, stats) for name, stats in statement_stats.items() if stats[0]]
+    if not used:
+        print("No statements executed yet.")
+        pause()
+        return
+
+    print(f"{'Statement':<26} {'Runs':>8} {'Total ms':>12} {'Avg ms':>10} {'Max ms':>10}")
+    print("-" * 70)
+    for name, (count, total, slowest) in sorted(used, key=lambda entry: entry[1][1], reverse=True):
+        print(f"{name:<26} {count:>8} {total * 1000:>12.2f} {total / count * 1000:>10.3f} {slowest * 1000:>10.3f}")
+    pause()
+
+# === Stock ledger ===
+MOVEMENT_TYPES = ("receipt", "sale", "adjustment", "delete")
+COMPACTION_INTERVAL_SECONDS = 60
+COMPACTION_BATCH_SIZE = 500
+
+def record_movement(current_user_id, item_id, movement_type, qty_change, connection=None):
+    """Append a stock movement. The caller commits it with the rest of its transaction."""
+    if movement_type not in MOVEMENT_TYPES:
+        raise ValueError(f"Unknown movement type: {movement_type}")
+    run_statement(
+        "movement_insert",
+        (current_user_id, item_id, movement_type, qty_change),
+        connection=connection
+    )
+
+def current_quantity(item_id, current_user_id, connection=None):
+    row = run_statement("item_quantity", (item_id, current_user_id), fetch="one", connection=connection)
+    return row[0] if row else None
+
+def compact_stock_ledger(connection, batch_size=COMPACTION_BATCH_SIZE):
+    """Fold one batch of the ledger tail into inventory snapshots. Returns rows compacted."""
+    try:
+        rows = run_statement("movement_pending", (batch_size,), fetch="all", connection=connection)
+        if not rows:
+            commit(connection)
+            return 0
+
+        deltas = {}
+        for _, item_id, qty_change in rows:
+            deltas[item_id] = deltas.get(item_id, 0) + qty_change
+
+        for item_id, delta in deltas.items():
+            if delta:
+                run_statement("item_apply_delta", (delta, item_id), connection=connection)
+        for movement_id, _, _ in rows:
+            run_statement("movement_mark_compacted", (movement_id,), connection=connection)
+        commit(connection)
+        return len(rows)
+    except mysql.connector.Error:
+        rollback(connection)
+        raise
+
+def _background_loop(step, batch_size, interval):
+    """Run step(connection) in full batches every interval seconds, for a worker thread."""
+    # Own connection: the shared one belongs to the menu thread.
+    connection = None
+    while True:
+        try:
+            if connection is None:
+                # READ COMMITTED avoids gap locks that would block concurrent sales inserts
+                connection = open_connection(mysql_password, database="inventory_db", isolation="READ COMMITTED")
+            while step(connection) == batch_size:
+                pass
+        except mysql.connector.Error:
+            # Silent on purpose: printing here would garble the menus. Retry next round.
+            if connection is not None:
+                discard_connection(connection)
+            connection = None
+        time.sleep(interval)
+
+def start_compaction_worker():
+    worker = threading.Thread(
+        target=_background_loop,
+        args=(compact_stock_ledger, COMPACTION_BATCH_SIZE, COMPACTION_INTERVAL_SECONDS),
+        name="ledger-compaction",
+        daemon=True
+    )
+    worker.start()
+    return worker
+
+# === Dashboard summary ===
+# Every checkout adds to the totals, and this is the only per-user row a
+# checkout writes (stock goes to the ledger, change events are sequenced
+# after commit). One row per user would make a shop's cashiers queue on its
+# lock; deltas go to one of SUMMARY_SLOTS rows picked at random instead, and
+# readers add the slots up.
+SUMMARY_SLOTS = 8
+
+def apply_summary(current_user_id, items=0, cost=0, retail=0, sales=0, gst=0, connection=None):
+    """Add deltas (money in paise) to the user's dashboard totals inside the caller's transaction.
+
+    This locks one summary slot until commit, so call it just before commit.
+    """
+    deltas = (items,) + tuple(Decimal(paise).scaleb(-2) for paise in (cost, retail, sales, gst))
+    slot = random.randrange(SUMMARY_SLOTS)
+    run_statement("summary_apply", (current_user_id, slot) + deltas + deltas, connection=connection)
+
+def rebuild_summary(current_user, current_user_id, connection=None):
+    """Recompute the dashboard totals from inventory and today's sales rows."""
+    # End any open transaction so the snapshot read below starts after the lock
+    # on all of the user's slots: writers that committed before it are in the
+    # source totals, and writers that commit after it add their deltas on top.
+    rollback(connection)
+    run_statement("summary_lock", (current_user_id,), fetch="one", connection=connection)
+    items, cost, retail = run_statement(
+        "summary_stock_from_source", (current_user_id,), fetch="one", connection=connection
+    )
+
+    # Today is always in the current month, which is never archived
+    today = datetime.now().strftime("%Y-%m-%d")
+    today_rows = [row for row in read_hot_rows(current_user) if row["Bill Date"].startswith(today)]
+    amounts = [sales_row_amounts(row) for row in today_rows]
+    sales = Decimal(sum(final for _, _, _, final in amounts)).scaleb(-2)
+    gst = Decimal(sum(gst for _, _, gst, _ in amounts)).scaleb(-2)
+
+    # The whole total goes into slot 0; the other slots start again from zero
+    values = (items, cost, retail, sales, gst)
+    run_statement("summary_replace", (current_user_id,) + values + values, connection=connection)
+    run_statement("summary_clear_slots", (current_user_id,), connection=connection)
+    commit(connection)
+
+def print_summary_header(current_user_id):
+    try:
+        # End the menu's read-only transaction so other counters' sales show up
+        rollback()
+        row = run_statement("summary_get", (current_user_id,), fetch="one")
+    except mysql.connector.Error as e:
+        print(f"Dashboard totals unavailable: {e}")
+        return
+    if not row:
+        return
+    # Slots last written on an earlier day already count as zero sales today
+    items, cost, retail, sales, gst = row
+    print(
+        f"Items: {items} | Stock value @cost: Rs {format_rupees(to_paise(cost))} "
+        f"| @retail: Rs {format_rupees(to_paise(retail))}"
+    )
+    print(f"Today's sales: Rs {format_rupees(to_paise(sales))} | GST collected: Rs {format_rupees(to_paise(gst))}")
+
+def reconcile_summary(current_user, current_user_id):
+    print("\n=== REBUILD DASHBOARD TOTALS ===")
+    try:
+        rebuild_summary(current_user, current_user_id)
+        print("Dashboard totals rebuilt from inventory and sales history.")
+    except mysql.connector.Error as e:
+        rollback()
+        print(f"Failed to rebuild totals: {e}")
+    pause()
+
+# === Change feed ===
+CHANGE_FEED_PAGE_SIZE = 1000
+CHANGE_SEQUENCE_INTERVAL_SECONDS = 1
+CHANGE_SEQUENCE_BATCH_SIZE = 500
+
+def log_changes(current_user_id, changes, connection=None):
+    """Queue (entity, entity_id, operation, payload) events with the caller's transaction.
+
+    They reach the change log, with their seq, once the sequencer sees them committed.
+    """
+    for entity, entity_id, operation, payload in changes:
+        run_statement(
+            "change_pending_insert",
+            (current_user_id, entity, str(entity_id), operation, json.dumps(payload, default=str)),
+            connection=connection
+        )
+
+def inventory_event(item_id, name, supplier_id, price, supplier_price, gst_percent, qty_change=0, movement=None):
+    """Payload of an inventory event: money in paise and rates in basis points, as in bill events.
+
+    "movement" is there only when the change wrote a stock movement of that type.
+    """
+    payload = {
+        "id": item_id,
+        "name": name,
+        "supplier_id": supplier_id,
+        "price": to_paise(price),
+        "supplier_price": to_paise(supplier_price),
+        "gst_bp": to_basis_points(gst_percent),
+        "qty_change": qty_change
+    }
+    if movement:
+        payload["movement"] = movement
+    return payload
+
+def sequence_changes(connection, batch_size=CHANGE_SEQUENCE_BATCH_SIZE):
+    """Move one batch of committed events into the change log. Returns events moved.
+
+    A named lock keeps this to one sequencer across all running copies of the
+    app; the others return 0 until it is free.
+    """
+    try:
+        if not run_statement("sequencer_lock", fetch="one", connection=connection)[0]:
+            return 0
+        try:
+            rows = run_statement("change_pending_batch", (batch_size,), fetch="all", connection=connection)
+            by_user = {}
+            for change_id, user_id in rows:
+                by_user.setdefault(user_id, []).append(change_id)
+
+            for user_id, change_ids in by_user.items():
+                # One round trip reserves the user's whole block of sequence numbers
+                last_seq = run_statement(
+                    "change_seq_reserve",
+                    (user_id, len(change_ids), len(change_ids)),
+                    connection=connection
+                ).lastrowid
+                for seq, change_id in enumerate(change_ids, start=last_seq - len(change_ids) + 1):
+                    run_statement("change_insert_from_pending", (seq, change_id), connection=connection)
+                    run_statement("change_pending_delete", (change_id,), connection=connection)
+            commit(connection)
+            return len(rows)
+        finally:
+            run_statement("sequencer_unlock", fetch="one", connection=connection)
+    except mysql.connector.Error:
+        rollback(connection)
+        raise
+
+def start_change_sequencer():
+    worker = threading.Thread(
+        target=_background_loop,
+        args=(sequence_changes, CHANGE_SEQUENCE_BATCH_SIZE, CHANGE_SEQUENCE_INTERVAL_SECONDS),
+        name="change-sequencer",
+        daemon=True
+    )
+    worker.start()
+    return worker
+
+def stream_changes(current_user_id, since, out=sys.stdout):
+    """Write change events after seq `since` as JSON Lines, one page at a time."""
+    while True:
+        rows = run_statement(
+            "change_feed",
+            (current_user_id, since, CHANGE_FEED_PAGE_SIZE),
+            fetch="all"
+        )
+        for seq, entity, entity_id, operation, payload, created_at in rows:
+            if isinstance(payload, (bytes, bytearray)):
+                payload = payload.decode("utf-8")
+            out.write(json.dumps({
+                "seq": seq,
+                "entity": entity,
+                "id": entity_id,
+                "op": operation,
+                "at": str(created_at),
+                "data": json.loads(payload)
+            }) + "\n")
+        out.flush()
+        if len(rows) < CHANGE_FEED_PAGE_SIZE:
+            return
+        since = rows[-1][0]
+
+def changes_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="I_M_S_CLI.py changes",
+        description="Stream inventory, supplier and bill changes as JSON Lines."
+    )
+    parser.add_argument("--since", type=int, default=0, help="last sequence number already synced")
+    parser.add_argument("--user", required=True, help="app username whose changes to stream")
+    args = parser.parse_args(argv)
+
+    global conn, cursor, mysql_password
+    # stdout carries the feed, so the password prompt must not go there
+    mysql_password = os.environ.get("IMS_MYSQL_PASSWORD") or getpass.getpass("Enter MySQL root password: ")
+    try:
+        conn = open_connection(mysql_password)
+        cursor = conn.cursor()
+        create_schema(cursor, conn)
+        manage_connection(conn, "inventory_db")
+
+        user_row = run_statement("user_id_by_name", (args.user,), fetch="one")
+        if not user_row:
+            print(f"No such user: {args.user}", file=sys.stderr)
+            exit(1)
+        # Include events committed since the app's sequencer last ran, or while it is not running
+        while sequence_changes(conn) == CHANGE_SEQUENCE_BATCH_SIZE:
+            pass
+        stream_changes(user_row[0], args.since)
+    except mysql.connector.Error as e:
+        print(f"MySQL error: {e}", file=sys.stderr)
+        exit(1)
+    finally:
+        if conn is not None:
+            conn.close()
+
+# === Sales archive ===
+# Closed months are moved out of bill_history.csv and the user folder into
+# archive/sales_YYYY-MM.csv.gz and archive/bills_YYYY-MM.tar.xz, with a
+# summary per month in archive/index.json. The current month stays hot.
+SALES_CSV_HEADER = [
+    "Bill_ID", "Bill Date", "Customer Name", "Phone", "Address",
+    "Item Name", "Quantity", "Supplier Price", "Selling Price",
+    "Total Price", "Discount%", "Discounted Price",
+    "GST%", "GST Amount", "Final Price (after GST)"
+]
+BILL_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def ensure_archive_folder(username: str) -> str:
+    folder_path = os.path.join(ensure_user_folder(username), "archive")
+    os.makedirs(folder_path, exist_ok=True)
+    return folder_path
+
+def load_archive_index(username):
+    index_path = os.path.join(ensure_archive_folder(username), "index.json")
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _replace_file(path, write):
+    # Write beside the target and swap in, so a crash never leaves half a file
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+# <customer first name>_<YYYYmmddHHMMSSffffff>.txt, as written by save_bill
+BILL_FILE_PATTERN = re.compile(r"^.*_(\d{20})\.txt$")
+
+def bill_file_date(filename):
+    """Bill date of a TXT bill, read from the timestamp bill ID in its name.
+
+    None for any other file, such as notes the user keeps in their folder.
+    """
+    match = BILL_FILE_PATTERN.match(filename)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1)[:14], "%Y%m%d%H%M%S").strftime(BILL_DATE_FORMAT)
+    except ValueError:
+        return None
+
+def summarize_partition(rows):
+    dates = [row["Bill Date"] for row in rows]
+    return {
+        "first_date": min(dates),
+        "last_date": max(dates),
+        "bills": len({row["Bill_ID"] for row in rows}),
+        "sales_paise": sum(sales_row_amounts(row)[3] for row in rows),
+        "gst_paise": sum(sales_row_amounts(row)[2] for row in rows),
+        "cost_paise": sum(sales_row_amounts(row)[0] for row in rows),
+        "customers": sorted({row["Customer Name"] for row in rows}),
+    }
+
+def read_partition_rows(username, month):
+    sales_path = os.path.join(ensure_archive_folder(username), f"sales_{month}.csv.gz")
+    if not os.path.exists(sales_path):
+        return []
+    with gzip.open(sales_path, "rt", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+def read_partition_bill_names(username, month):
+    bills_path = os.path.join(ensure_archive_folder(username), f"bills_{month}.tar.xz")
+    if not os.path.exists(bills_path):
+        return []
+    with tarfile.open(bills_path, "r:xz") as tar:
+        return tar.getnames()
+
+def _with_bill_dates(summary, filenames):
+    """A month's index entry, widened to cover its archived TXT bills.
+
+    A month can have bills but no sales rows (a missing or old CSV, or a crash
+    between writing the TXT and appending to the CSV). list_bills only opens
+    months in the index, so those bills still need an entry.
+    """
+    dates = [date for date in map(bill_file_date, filenames) if date]
+    if summary is None:
+        summary = {
+            "first_date": min(dates),
+            "last_date": max(dates),
+            "bills": 0,
+            "sales_paise": 0,
+            "gst_paise": 0,
+            "cost_paise": 0,
+            "customers": [],
+        }
+    if dates:
+        summary["first_date"] = min(summary["first_date"], min(dates))
+        summary["last_date"] = max(summary["last_date"], max(dates))
+        summary["bills"] = max(summary["bills"], len(dates))
+    return summary
+
+def read_hot_rows(username):
+    csv_path = os.path.join(ensure_user_folder(username), "bill_history.csv")
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+def _write_sales_partition(username, month, rows):
+    sales_path = os.path.join(ensure_archive_folder(username), f"sales_{month}.csv.gz")
+
+    def write(path):
+        with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SALES_CSV_HEADER)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    _replace_file(sales_path, write)
+
+def _write_bills_partition(username, month, filenames):
+    user_folder = ensure_user_folder(username)
+    bills_path = os.path.join(ensure_archive_folder(username), f"bills_{month}.tar.xz")
+
+    def write(path):
+        with tarfile.open(path, "w:xz") as tar:
+            # A compressed tar cannot be appended to, so carry over what is already archived
+            if os.path.exists(bills_path):
+                with tarfile.open(bills_path, "r:xz") as old:
+                    for member in old.getmembers():
+                        if member.name not in filenames:
+                            tar.addfile(member, old.extractfile(member))
+            for filename in filenames:
+                tar.add(os.path.join(user_folder, filename), arcname=filename)
+
+    _replace_file(bills_path, write)
+
+def archive_closed_months(username):
+    """Move sales rows and TXT bills of months before the current one into archives."""
+    user_folder = ensure_user_folder(username)
+    current_month = datetime.now().strftime("%Y-%m")
+
+    hot_rows = read_hot_rows(username)
+    closed_rows = {}
+    keep_rows = []
+    for row in hot_rows:
+        month = row["Bill Date"][:7]
+        if month < current_month:
+            closed_rows.setdefault(month, []).append(row)
+        else:
+            keep_rows.append(row)
+
+    closed_bills = {}
+    for filename in os.listdir(user_folder):
+        bill_date = bill_file_date(filename)
+        # Anything that is not a bill stays where it is
+        if bill_date and bill_date[:7] < current_month:
+            closed_bills.setdefault(bill_date[:7], []).append(filename)
+
+    if not closed_rows and not closed_bills:
+        return
+
+    index = load_archive_index(username)
+    for month in sorted(set(closed_rows) | set(closed_bills)):
+        summary = index.get(month)
+        if month in closed_rows:
+            # Skip bills already archived by an earlier run that stopped half way
+            archived = read_partition_rows(username, month)
+            archived_ids = {row["Bill_ID"] for row in archived}
+            merged = archived + [row for row in closed_rows[month] if row["Bill_ID"] not in archived_ids]
+            _write_sales_partition(username, month, merged)
+            summary = summarize_partition(merged)
+        if month in closed_bills:
+            _write_bills_partition(username, month, closed_bills[month])
+        index[month] = _with_bill_dates(summary, read_partition_bill_names(username, month))
+
+    def write_index(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+
+    _replace_file(os.path.join(ensure_archive_folder(username), "index.json"), write_index)
+
+    # Archives are safely on disk; now drop the closed months from the hot set
+    if closed_rows:
+        def write_hot(path):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=SALES_CSV_HEADER)
+                writer.writeheader()
+                writer.writerows(keep_rows)
+
+        _replace_file(os.path.join(user_folder, "bill_history.csv"), write_hot)
+    for filenames in closed_bills.values():
+        for filename in filenames:
+            os.remove(os.path.join(user_folder, filename))
+
+def _overlapping_months(index, start, end, customer=None):
+    months = []
+    for month, summary in sorted(index.items()):
+        if end and summary["first_date"] > end:
+            continue
+        if start and summary["last_date"] < start:
+            continue
+        if customer and not any(customer in name.lower() for name in summary["customers"]):
+            continue
+        months.append(month)
+    return months
+
+def _in_range(bill_date, start, end):
+    return (not start or bill_date >= start) and (not end or bill_date <= end)
+
+def load_sales_rows(username, start=None, end=None):
+    """Sales rows with Bill Date in [start, end], opening only overlapping partitions."""
+    rows = []
+    for month in _overlapping_months(load_archive_index(username), start, end):
+        rows.extend(read_partition_rows(username, month))
+    rows.extend(read_hot_rows(username))
+    return [row for row in rows if _in_range(row["Bill Date"], start, end)]
+
+def list_bills(username, start=None, end=None, customer=None):
+    """(month or None if hot, filename) of TXT bills in range, newest first."""
+    customer = customer.lower() if customer else None
+    user_folder = ensure_user_folder(username)
+    bills = []
+
+    hot_customers = {row["Bill_ID"]: row["Customer Name"] for row in read_hot_rows(username)}
+    for filename in os.listdir(user_folder):
+        bill_date = bill_file_date(filename)
+        if bill_date and _in_range(bill_date, start, end):
+            bills.append((None, filename, hot_customers))
+
+    for month in _overlapping_months(load_archive_index(username), start, end, customer):
+        customers = {row["Bill_ID"]: row["Customer Name"] for row in read_partition_rows(username, month)}
+        for filename in read_partition_bill_names(username, month):
+            bill_date = bill_file_date(filename)
+            if bill_date and _in_range(bill_date, start, end):
+                bills.append((month, filename, customers))
+
+    if customer:
+        bills = [
+            (month, filename, customers) for month, filename, customers in bills
+            if customer in customers.get(os.path.splitext(filename)[0].rsplit("_", 1)[-1], "").lower()
+        ]
+    bills.sort(key=lambda bill: bill_file_date(bill[1]), reverse=True)
+    return [(month, filename) for month, filename, _ in bills]
+
+def read_bill(username, month, filename):
+    if month is None:
+        with open(os.path.join(ensure_user_folder(username), filename), "r", encoding="utf-8") as f:
+            return f.read()
+    bills_path = os.path.join(ensure_archive_folder(username), f"bills_{month}.tar.xz")
+    with tarfile.open(bills_path, "r:xz") as tar:
+        return tar.extractfile(filename).read().decode("utf-8")
+
+def ask_date_range():
+    """Ask for an optional From/To date. Returns bill-date strings or None for open ends."""
+    from_str = input("From date YYYY-MM-DD (blank for beginning): ").strip()
+    to_str = input("To date YYYY-MM-DD (blank for now): ").strip()
+    start = datetime.strptime(from_str, "%Y-%m-%d").strftime(BILL_DATE_FORMAT) if from_str else None
+    # "To" date is inclusive of the whole day
+    end = datetime.strptime(to_str, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59.999999") if to_str else None
+    return start, end
+
 def login_user():
     while True:
         print("\n=== LOGIN ===")
@@ -91,8 +1249,7 @@ def login_user():
 
         try:
             # Fetch user ID from users table
-            cursor.execute("SELECT id FROM users WHERE username=%s AND password=%s", (user, pwd))
-            result = cursor.fetchone()
+            result = run_statement("user_login", (user, pwd), fetch="one")
             if not result:
                 print("Invalid username or password. Try again.")
                 continue
@@ -103,7 +1260,9 @@ def login_user():
             return user, user_id
 
         except mysql.connector.Error:
+            # Reconnect attempts are already exhausted; back to the main menu
             print(f"Database error during login.")
+            return None
 
 def signup_user():
     while True:
@@ -117,11 +1276,8 @@ def signup_user():
 
         try:
             # Insert into app users table
-            cursor.execute(
-                "INSERT INTO users (username, password) VALUES (%s, %s)",
-                (user, pwd)
-            )
-            conn.commit()
+            run_statement("user_insert", (user, pwd))
+            commit()
 
             ensure_user_folder(user)
             print("Account created. You can now log in.")
@@ -157,17 +1313,16 @@ def add_supplier(current_user_id):
     address = input("Supplier Address: ").strip()
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO suppliers (user_id, supplier_name, supplier_phone, supplier_address)
-            VALUES (%s, %s, %s, %s)
-            """,
-            (current_user_id, name, phone, address)
-        )
-        conn.commit()
+        supplier_id = run_statement("supplier_insert", (current_user_id, name, phone, address)).lastrowid
+        log_changes(current_user_id, [("supplier", supplier_id, "insert", {
+            "id": supplier_id, "name": name, "phone": phone, "address": address
+        })])
+        commit()
         print("Supplier added successfully.")
-    except mysql.connector.Error:
-        print(f"Failed to add supplier.")
+    except mysql.connector.Error as e:
+        # Otherwise the insert would ride along with the next commit, without its change event
+        rollback()
+        print(f"Failed to add supplier: {e}")
 
     pause()
 
@@ -222,8 +1377,7 @@ def add_stock(current_user_id):
                 print("Invalid input. Enter a numeric GST value.")
 
         # --- Supplier selection (mandatory) ---
-        cursor.execute("SELECT id, supplier_name FROM suppliers WHERE user_id=%s ORDER BY id ASC", (current_user_id,))
-        suppliers = cursor.fetchall()
+        suppliers = run_statement("supplier_choices", (current_user_id,), fetch="all")
 
         if not suppliers:
             print("No suppliers found. Please add a supplier first.")
@@ -257,41 +1411,50 @@ def add_stock(current_user_id):
             continue
 
         # --- Merge items per supplier ---
-        cursor.execute(
-            "SELECT id, quantity FROM inventory WHERE user_id=%s AND name=%s AND price=%s AND gst_percent=%s AND supplier_id=%s",
-            (current_user_id, name, price, gst_percent, supplier_id)
-        )
-        existing = cursor.fetchone()
-        if existing:
-            item_id, existing_qty = existing
-            new_qty = existing_qty + qty
-            cursor.execute(
-                "UPDATE inventory SET quantity=%s, supplier_price=%s WHERE id=%s",
-                (new_qty, supplier_price, item_id)
+        try:
+            existing = run_statement(
+                "item_merge_lookup",
+                (current_user_id, name, price, gst_percent, supplier_id),
+                fetch="one"
             )
-            action = "updated"
-        else:
-            cursor.execute(
-                "INSERT INTO inventory (user_id, supplier_id, name, quantity, price, supplier_price, gst_percent) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                (current_user_id, supplier_id, name, qty, price, supplier_price, gst_percent)
+            if existing:
+                item_id, existing_qty, old_supplier_price = existing
+                run_statement("item_set_supplier_price", (supplier_price, item_id))
+                # Existing units are now valued at the new supplier price too
+                cost_delta = (existing_qty + qty) * to_paise(supplier_price) - existing_qty * to_paise(old_supplier_price)
+                action = "updated"
+            else:
+                # Quantity starts at 0; the receipt movement below carries the stock
+                item_id = run_statement(
+                    "item_insert",
+                    (current_user_id, supplier_id, name, price, supplier_price, gst_percent)
+                ).lastrowid
+                cost_delta = qty * to_paise(supplier_price)
+                action = "added"
+
+            record_movement(current_user_id, item_id, "receipt", qty)
+            apply_summary(
+                current_user_id,
+                items=1 if action == "added" else 0,
+                cost=cost_delta,
+                retail=qty * to_paise(price)
             )
-            action = "added"
-
-        conn.commit()
+            event = inventory_event(
+                item_id, name, supplier_id, price, supplier_price, gst_percent, qty_change=qty, movement="receipt"
+            )
+            log_changes(current_user_id, [("inventory", item_id, "insert" if action == "added" else "update", event)])
+            commit()
+        except mysql.connector.Error as e:
+            rollback()
+            print(f"Failed to save {name}: {e}")
+            continue
         print(f"Item {action} successfully: {name} x{qty} @ Rs.{price:.2f}")
 
     pause()
 
 def view_stock(current_user_id, do_pause=True):
     print("\n=== VIEW STOCK ===")
-    cursor.execute("""
-        SELECT i.id, i.name, i.quantity, i.price, i.gst_percent, s.supplier_name, i.supplier_price
-        FROM inventory i
-        LEFT JOIN suppliers s ON i.supplier_id = s.id
-        WHERE i.user_id=%s
-    """, (current_user_id,))
-    rows = cursor.fetchall()
+    rows = run_read_statement("stock_list", (current_user_id,))
 
     if not rows:
         print("No items in inventory.")
@@ -311,11 +1474,7 @@ def view_stock(current_user_id, do_pause=True):
 
 def view_suppliers(current_user_id):
     print("\n=== SUPPLIERS ===")
-    cursor.execute(
-        "SELECT id, supplier_name, supplier_phone, supplier_address FROM suppliers WHERE user_id=%s",
-        (current_user_id,)
-    )
-    rows = cursor.fetchall()
+    rows = run_read_statement("supplier_list", (current_user_id,))
     if not rows:
         print("No suppliers yet.")
         return
@@ -341,19 +1500,16 @@ def edit_item(current_user_id):
         return
 
     updates = []  # store all changes here
+    old_prices = {}  # id -> (price, supplier_price) in paise, for the dashboard totals
 
     for item_id in item_ids:
-        cursor.execute(
-            "SELECT name, quantity, price, gst_percent, supplier_price FROM inventory WHERE id=%s AND user_id=%s",
-            (item_id, current_user_id)
-        )
-        item = cursor.fetchone()
+        item = run_statement("item_for_edit", (item_id, current_user_id), fetch="one")
 
         if not item:
             print(f"ID {item_id} not found. Skipping...")
             continue
 
-        name, old_qty, old_price, old_gst, old_supplier_price = item
+        name, old_qty, old_price, old_gst, old_supplier_price, supplier_id = item
         print(f"\nEditing: {name} (ID: {item_id})")
         print(
             f"Current Qty: {old_qty}, Price: ₹{float(old_price):.2f}, GST%: {old_gst}, Supplier Price: ₹{float(old_supplier_price):.2f}")
@@ -387,10 +1543,14 @@ def edit_item(current_user_id):
                 print(f"No changes for '{name}'. Skipping.")
                 continue
 
+            old_prices[item_id] = (to_paise(old_price), to_paise(old_supplier_price))
             updates.append({
                 "id": item_id,
                 "name": name,
+                "supplier_id": supplier_id,
                 "quantity": new_qty,
+                # Relative to what was shown, so sales made meanwhile are not undone
+                "qty_change": new_qty - old_qty,
                 "price": new_price,
                 "gst_percent": new_gst,
                 "supplier_price": new_supplier_price
@@ -417,14 +1577,39 @@ def edit_item(current_user_id):
         print("Update cancelled for all items.")
         return
 
-    # Apply updates
-    for u in updates:
-        cursor.execute(
-            "UPDATE inventory SET quantity=%s, price=%s, gst_percent=%s, supplier_price=%s WHERE id=%s AND user_id=%s",
-            (u["quantity"], u["price"], u["gst_percent"], u["supplier_price"], u["id"], current_user_id)
-        )
-    conn.commit()
-    print("All changes applied successfully!")
+    # Apply updates. Nothing is written yet, so end the read-only transaction
+    # first: the quantities used for valuation then come from a fresh snapshot.
+    rollback()
+    changes = []
+    cost_delta = retail_delta = 0
+    try:
+        for u in updates:
+            qty_before = current_quantity(u["id"], current_user_id)
+            if qty_before is None:
+                print(f"ID {u['id']} was deleted meanwhile. Skipping.")
+                continue
+            run_statement(
+                "item_update_details",
+                (u["price"], u["gst_percent"], u["supplier_price"], u["id"], current_user_id)
+            )
+            if u["qty_change"]:
+                record_movement(current_user_id, u["id"], "adjustment", u["qty_change"])
+
+            old_price, old_supplier_price = old_prices[u["id"]]
+            qty_after = qty_before + u["qty_change"]
+            cost_delta += qty_after * to_paise(u["supplier_price"]) - qty_before * old_supplier_price
+            retail_delta += qty_after * to_paise(u["price"]) - qty_before * old_price
+            changes.append(("inventory", u["id"], "update", inventory_event(
+                u["id"], u["name"], u["supplier_id"], u["price"], u["supplier_price"], u["gst_percent"],
+                qty_change=u["qty_change"], movement="adjustment" if u["qty_change"] else None
+            )))
+        apply_summary(current_user_id, cost=cost_delta, retail=retail_delta)
+        log_changes(current_user_id, changes)
+        commit()
+        print("All changes applied successfully!")
+    except mysql.connector.Error as e:
+        rollback()
+        print(f"Failed to apply changes, nothing was updated: {e}")
 
 def delete_item(current_user_id):
     print("\n=== DELETE ITEM ===")
@@ -438,8 +1623,7 @@ def delete_item(current_user_id):
         item_id = int(item_id_str)
 
         # Verify exists
-        cursor.execute("SELECT name FROM inventory WHERE id=%s AND user_id=%s", (item_id, current_user_id))
-        item = cursor.fetchone()
+        item = run_statement("item_for_delete", (item_id, current_user_id), fetch="one")
         if not item:
             print(f"ID {item_id} not found.")
             pause()
@@ -447,8 +1631,27 @@ def delete_item(current_user_id):
 
         confirm = input(f"Delete '{item[0]}' (y/n): ").strip().lower()
         if confirm == 'y':
-            cursor.execute("DELETE FROM inventory WHERE id=%s AND user_id=%s", (item_id, current_user_id))
-            conn.commit()
+            # Sales may have gone through while confirming. Lock the item so no more
+            # can, then read its stock in a snapshot started after the lock.
+            rollback()
+            run_statement("item_lock", (item_id, current_user_id), fetch="one")
+            qty_now = current_quantity(item_id, current_user_id)
+            if qty_now is None:
+                print(f"ID {item_id} was deleted meanwhile.")
+                pause()
+                return
+            record_movement(current_user_id, item_id, "delete", -qty_now)
+            run_statement("item_delete", (item_id, current_user_id))
+            apply_summary(
+                current_user_id,
+                items=-1,
+                cost=-qty_now * to_paise(item[2]),
+                retail=-qty_now * to_paise(item[1])
+            )
+            log_changes(current_user_id, [("inventory", item_id, "delete", inventory_event(
+                item_id, item[0], item[4], item[1], item[2], item[3], qty_change=-qty_now, movement="delete"
+            ))])
+            commit()
             print("Item deleted!")
             pause()
         else:
@@ -456,6 +1659,10 @@ def delete_item(current_user_id):
     except ValueError:
         print("Invalid ID.")
         pause()
+    except mysql.connector.Error as e:
+        rollback()
+        print(f"Failed to delete item: {e}")
+        pause()
 
 def generate_bill_txt(current_user, current_user_id):
     print("\n=== GENERATE BILL ===")
@@ -478,18 +1685,15 @@ def generate_bill_txt(current_user, current_user_id):
         pause()
         return
 
+    # Fresh snapshot: the menu's may be hours old and miss sales at other counters
+    rollback()
     item_ids = [x.strip() for x in item_ids_input.split(",")]
     selected_items = []
 
     for item_id_str in item_ids:
         try:
             item_id = int(item_id_str)
-            cursor.execute(
-                "SELECT id, name, quantity, price, gst_percent, supplier_price "
-                "FROM inventory WHERE id=%s AND user_id=%s",
-                (item_id, current_user_id)
-            )
-            row = cursor.fetchone()
+            row = run_statement("item_for_bill", (item_id, current_user_id), fetch="one")
             if row:
                 print(f"Selected: {row[1]}, Available: {row[2]}, Price: {row[3]}, GST%: {row[4]}")
                 selected_items.append(row)
@@ -503,23 +1707,13 @@ def generate_bill_txt(current_user, current_user_id):
     # ---------------- QUANTITY ----------------
     bill_items = []
 
-    for item_id, name, stock, price, gst_percent, supplier_price in selected_items:
+    for row in selected_items:
         try:
-            qty = int(input(f"Enter quantity for {name}: "))
-            if qty <= 0 or qty > stock:
+            qty = int(input(f"Enter quantity for {row[1]}: "))
+            if qty <= 0 or qty > row[2]:
                 print("Invalid quantity. Skipped.")
                 continue
-
-            base = qty * float(price)
-            bill_items.append({
-                "id": item_id,
-                "name": name,
-                "qty": qty,
-                "price": float(price),
-                "gst_percent": float(gst_percent),
-                "supplier_price": float(supplier_price),
-                "base": base
-            })
+            bill_items.append(make_bill_item(row, qty))
         except:
             continue
 
@@ -527,58 +1721,146 @@ def generate_bill_txt(current_user, current_user_id):
         print("Nothing to bill.")
         return
 
-    total_base_price = sum(item["base"] for item in bill_items)
-    print(f"Total Price : {total_base_price:.2f}")
+    total_base_price = compute_bill(bill_items, 0)["base"]
+    print(f"Total Price : {format_rupees(total_base_price)}")
 
     # ---------------- DISCOUNT ----------------
     while True:
         discount_str = input("Enter Discount% if any (0-100): ").strip()
         if not discount_str:
-            discount_percent = 0.0
+            discount_percent = Decimal(0)
             break
         try:
-            discount_percent = float(discount_str)
+            discount_percent = Decimal(discount_str)
             if 0 <= discount_percent <= 100:
                 break
             else:
                 print("Discount must be between 0 and 100.")
-        except ValueError:
+        except (ArithmeticError, ValueError):
             print("Enter a valid number for discount.")
 
-    discount_factor = 1 - (discount_percent / 100)
-
     # ---------------- GST AFTER DISCOUNT ----------------
-    total_gst = 0.0
-    final_total = 0.0
+    discount_bp = to_basis_points(discount_percent)
+    totals = compute_bill(bill_items, discount_bp)
 
-    for item in bill_items:
-        discounted_base = max(item["base"] * discount_factor, 0)
-        gst_amount = max(discounted_base * (item["gst_percent"] / 100), 0)
-
-        item["discounted_base"] = discounted_base
-        item["gst_amount"] = gst_amount
-        item["final"] = discounted_base + gst_amount
+    print(f"GST Amount: {format_rupees(totals['gst'])}")
+    print(f"Final Price (after GST%): {format_rupees(totals['final'])}")
 
-        total_gst += gst_amount
-        final_total += item["final"]
+    bill = new_bill(customer_name, customer_phone, customer_address, bill_items, discount_bp, totals)
 
-    total_discounted_price = sum(item["discounted_base"] for item in bill_items)
+    # ---------------- UPDATE INVENTORY ----------------
+    try:
+        short = commit_sale(current_user_id, bill)
+    except mysql.connector.Error as e:
+        print(f"Checkout failed, nothing was billed: {e}")
+        pause()
+        return
+    if short:
+        print(f"Not enough stock left for: {', '.join(short)}. Nothing was billed.")
+        pause()
+        return
 
-    print(f"GST Amount: {total_gst:.2f}")
-    print(f"Final Price (after GST%): {final_total:.2f}")
+    # ---------------- TXT + CSV ----------------
+    txt_name = save_bill(current_user, bill)
+    print(f"Bill saved as TXT: {txt_name}")
+    print("Bill saved to history CSV.")
+    pause()
 
-    # ---------------- UPDATE INVENTORY ----------------
-    for item in bill_items:
-        cursor.execute(
-            "UPDATE inventory SET quantity = quantity - %s WHERE id=%s AND user_id=%s",
-            (item["qty"], item["id"], current_user_id)
+# === Checkout steps (shared with load_test.py) ===
+def make_bill_item(row, qty):
+    """Bill line (money in paise) from an item_for_bill row and a quantity already checked against stock."""
+    item_id, name, _, price, gst_percent, supplier_price = row
+    return {
+        "id": item_id,
+        "name": name,
+        "qty": qty,
+        "price": to_paise(price),
+        "gst_bp": to_basis_points(gst_percent),
+        "supplier_price": to_paise(supplier_price)
+    }
+
+# Bill IDs are timestamps; concurrent checkouts in one process must not share one
+_bill_clock_lock = threading.Lock()
+_last_bill_time = None
+
+def _next_bill_time():
+    global _last_bill_time
+    with _bill_clock_lock:
+        now = datetime.now()
+        if _last_bill_time is not None and now <= _last_bill_time:
+            now = _last_bill_time + timedelta(microseconds=1)
+        _last_bill_time = now
+        return now
+
+def new_bill(customer_name, customer_phone, customer_address, bill_items, discount_bp, totals):
+    now = _next_bill_time()
+    return {
+        "bill_id": now.strftime("%Y%m%d%H%M%S%f"),
+        "bill_date": now.strftime(BILL_DATE_FORMAT),
+        "customer_name": customer_name,
+        "customer_phone": customer_phone,
+        "customer_address": customer_address,
+        "items": bill_items,
+        "discount_bp": discount_bp,
+        "totals": totals
+    }
+
+def commit_sale(current_user_id, bill, connection=None):
+    """Record a checkout in one transaction. Returns the names of items short of stock.
+
+    If any item is short nothing is recorded. On a database error the
+    transaction is rolled back and the error re-raised.
+    """
+    needed = {}
+    names = {}
+    for item in bill["items"]:
+        needed[item["id"]] = needed.get(item["id"], 0) + item["qty"]
+        names[item["id"]] = item["name"]
+    try:
+        # Lock the items in id order, so two checkouts never wait on each other in a
+        # cycle, then check stock in a snapshot started after the locks. A sale of the
+        # same item waits here until this one commits; other items are not held up.
+        rollback(connection)
+        for item_id in sorted(needed):
+            run_statement("item_lock", (item_id, current_user_id), fetch="one", connection=connection)
+        short = []
+        for item_id in sorted(needed):
+            qty = current_quantity(item_id, current_user_id, connection=connection)
+            if qty is None or qty < needed[item_id]:
+                short.append(names[item_id])
+        if short:
+            rollback(connection)
+            return short
+
+        # Sales append to the ledger instead of updating the hot inventory row
+        for item in bill["items"]:
+            record_movement(current_user_id, item["id"], "sale", -item["qty"], connection=connection)
+        apply_summary(
+            current_user_id,
+            cost=-sum(item["qty"] * item["supplier_price"] for item in bill["items"]),
+            retail=-sum(item["base"] for item in bill["items"]),
+            sales=bill["totals"]["final"],
+            gst=bill["totals"]["gst"],
+            connection=connection
         )
-    conn.commit()
+        log_changes(current_user_id, [("bill", bill["bill_id"], "insert", bill)], connection=connection)
+        commit(connection)
+        return []
+    except mysql.connector.Error:
+        rollback(connection)
+        raise
 
-    # ---------------- TXT BILL ----------------
+def save_bill(current_user, bill):
+    """Write the TXT bill and append its lines to the history CSV. Returns the TXT file name."""
     user_folder = ensure_user_folder(current_user)
-    bill_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    bill_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    bill_id = bill["bill_id"]
+    bill_date = bill["bill_date"]
+    customer_name = bill["customer_name"]
+    customer_phone = bill["customer_phone"]
+    customer_address = bill["customer_address"]
+    bill_items = bill["items"]
+    discount_percent = format_percent(bill["discount_bp"])
+    totals = bill["totals"]
     first_name = customer_name.strip().split()[0]
     safe_name = "".join(c for c in first_name if c.isalnum())
     txt_path = os.path.join(user_folder, f"{safe_name}_{bill_id}.txt")
@@ -594,37 +1876,28 @@ def generate_bill_txt(current_user, current_user_id):
         f.write("=" * 90 + "\n\n")
 
         for item in bill_items:
-            line_base = item["base"]
             f.write(
-                f"{item['name']} x {item['qty']} @ Rs. {item['price']:.2f} "
-                f"= Rs. {line_base:.2f} "
-                f"(After discount: {item['discounted_base']:.2f}, "
-                f"GST {item['gst_percent']:.1f}%: {item['gst_amount']:.2f})\n"
+                f"{item['name']} x {item['qty']} @ Rs. {format_rupees(item['price'])} "
+                f"= Rs. {format_rupees(item['base'])} "
+                f"(After discount: {format_rupees(item['discounted'])}, "
+                f"GST {format_percent(item['gst_bp'])}%: {format_rupees(item['gst'])})\n"
             )
 
         f.write("\n" + "=" * 90 + "\n")
-        f.write(f"Total Price : Rs. {total_base_price:.2f}\n")
-        f.write(f"Discount% : {discount_percent:.2f}%\n")
-        f.write(f"Discounted Price : Rs. {total_discounted_price:.2f}\n")
-        f.write(f"GST Amount : Rs. {total_gst:.2f}\n")
-        f.write(f"Final Price (with GST) : Rs. {final_total:.2f}\n")
+        f.write(f"Total Price : Rs. {format_rupees(totals['base'])}\n")
+        f.write(f"Discount% : {discount_percent}%\n")
+        f.write(f"Discounted Price : Rs. {format_rupees(totals['discounted'])}\n")
+        f.write(f"GST Amount : Rs. {format_rupees(totals['gst'])}\n")
+        f.write(f"Final Price (with GST) : Rs. {format_rupees(totals['final'])}\n")
         f.write("=" * 90 + "\n")
 
-    print(f"Bill saved as TXT: {safe_name}_{bill_id}.txt")
-
-    # ---------------- CSV ----------------
     csv_path = os.path.join(user_folder, "bill_history.csv")
     exists = os.path.exists(csv_path)
 
     with open(csv_path, "a", newline="", encoding="utf-8") as file:
         writer = csv.writer(file)
         if not exists:
-            writer.writerow([
-                "Bill_ID", "Bill Date", "Customer Name", "Phone", "Address",
-                "Item Name", "Quantity", "Supplier Price", "Selling Price",
-                "Total Price", "Discount%", "Discounted Price",
-                "GST%", "GST Amount", "Final Price (after GST)"
-            ])
+            writer.writerow(SALES_CSV_HEADER)
 
         for item in bill_items:
             writer.writerow([
@@ -635,41 +1908,41 @@ def generate_bill_txt(current_user, current_user_id):
                 customer_address,
                 item["name"],
                 item["qty"],
-                round(item["supplier_price"], 2),
-                round(item["price"], 2),
-                round(item["base"], 2),
+                format_rupees(item["supplier_price"]),
+                format_rupees(item["price"]),
+                format_rupees(item["base"]),
                 discount_percent,
-                round(item["discounted_base"], 2),
-                item["gst_percent"],
-                round(item["gst_amount"], 2),
-                round(item["final"], 2)
+                format_rupees(item["discounted"]),
+                format_percent(item["gst_bp"]),
+                format_rupees(item["gst"]),
+                format_rupees(item["final"])
             ])
 
-    print("Bill saved to history CSV.")
-    pause()
+    return f"{safe_name}_{bill_id}.txt"
 
 def search_customer_bills(current_user):
     print("\n=== SEARCH CUSTOMER BILLS ===")
 
-    user_folder = ensure_user_folder(current_user)
+    archive_closed_months(current_user)
+    customer = input("Customer name contains (blank for any): ").strip()
+    try:
+        start, end = ask_date_range()
+    except ValueError:
+        print("Invalid date.")
+        pause()
+        return
 
-    # Get only .txt bills (ignore csv)
-    bill_files = [
-        f for f in os.listdir(user_folder)
-        if f.endswith(".txt")
-    ]
+    # Latest first; only archive partitions overlapping the range are opened
+    bill_files = list_bills(current_user, start, end, customer)
 
     if not bill_files:
         print("No bills found.")
         pause()
         return
 
-    # Sort by latest first (optional but better UX)
-    bill_files.sort(reverse=True)
-
     print("\nAvailable Bills:")
-    for idx, bill in enumerate(bill_files, start=1):
-        print(f"{idx}. {bill}")
+    for idx, (month, bill) in enumerate(bill_files, start=1):
+        print(f"{idx}. {bill}" + (f"  [archived {month}]" if month else ""))
 
     choice = input("\nSelect bill number (blank to cancel): ").strip()
     if not choice:
@@ -682,12 +1955,10 @@ def search_customer_bills(current_user):
             pause()
             return
 
-        selected_bill = bill_files[choice - 1]
-        bill_path = os.path.join(user_folder, selected_bill)
+        month, selected_bill = bill_files[choice - 1]
 
         print("\n" + "=" * 90)
-        with open(bill_path, "r", encoding="utf-8") as f:
-            print(f.read())
+        print(read_bill(current_user, month, selected_bill))
 
     except ValueError:
         print("Please enter a valid number.")
@@ -698,22 +1969,24 @@ def search_customer_bills(current_user):
 
 def view_sales_history(current_user):
     print("\n=== SALES HISTORY ===")
-    user_folder = ensure_user_folder(current_user)
-    csv_filename = os.path.join(user_folder, "bill_history.csv")
-
-    if not os.path.exists(csv_filename):
-        print("No sales history yet.")
+    archive_closed_months(current_user)
+    try:
+        start, end = ask_date_range()
+    except ValueError:
+        print("Invalid date.")
         pause()
         return
 
-    total_sales = 0.0
-    total_cost = 0.0
-    total_gst_all = 0.0
+    # All amounts in paise, read exactly from the CSV text
+    total_sales = 0
+    total_cost = 0
+    total_gst_all = 0
 
     try:
-        with open(csv_filename, mode="r", encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            rows = list(reader)
+        rows = load_sales_rows(current_user, start, end)
+        if not rows:
+            print("No sales history in this range.")
+            return
 
         # Group rows by Bill_ID
         bills = {}
@@ -732,31 +2005,25 @@ def view_sales_history(current_user):
         for bill_id, items in bills.items():
             bill_date = items[0]["Bill Date"]
             customer_name = items[0]["Customer Name"]
-            discount_percent = float(items[0].get("Discount%", 0) or 0)
-
-            # Total GST for this bill
-            total_gst = sum(float(i["GST Amount"] or 0) for i in items)
+            discount_percent = format_percent(to_basis_points(items[0].get("Discount%")))
+
+            # Supplier cost, discounted base, GST and final price paid by customer
+            amounts = [sales_row_amounts(i) for i in items]
+            total_supplier_cost = sum(a[0] for a in amounts)
+            total_discounted_base = sum(a[1] for a in amounts)
+            total_gst = sum(a[2] for a in amounts)
+            final_bill_price = sum(a[3] for a in amounts)
             total_gst_all += total_gst
 
-            # Supplier cost
-            total_supplier_cost = sum(
-                float(i["Supplier Price"] or 0) * int(i["Quantity"] or 0)
-                for i in items
-            )
-
-            # Final price paid by customer (Discounted Base + GST)
-            final_bill_price = sum(float(i["Final Price (after GST)"] or 0) for i in items)
-
             # Profit = Discounted Base - Supplier Cost
-            total_discounted_base = sum(float(i["Discounted Price"] or 0) for i in items)
             bill_profit = total_discounted_base - total_supplier_cost
 
-            pl_text = f"+{bill_profit:.2f}" if bill_profit > 0 else f"-{abs(bill_profit):.2f}" if bill_profit < 0 else "0.00"
+            pl_text = f"+{format_rupees(bill_profit)}" if bill_profit > 0 else format_rupees(bill_profit)
 
             print(
                 f"{serial_no:<6} {bill_date:<22} {customer_name:<25} "
-                f"{total_supplier_cost:>15.2f} {final_bill_price:>15.2f} "
-                f"{discount_percent:>10.2f} {pl_text:>15}"
+                f"{format_rupees(total_supplier_cost):>15} {format_rupees(final_bill_price):>15} "
+                f"{discount_percent:>10} {pl_text:>15}"
             )
 
             total_sales += final_bill_price
@@ -766,16 +2033,16 @@ def view_sales_history(current_user):
         # GST is excluded from profit calculation as it is payable to the government
         net = total_sales - total_cost - total_gst_all
         if net > 0:
-            overall = f"Net Profit of Rs {net:.2f}"
+            overall = f"Net Profit of Rs {format_rupees(net)}"
         elif net < 0:
-            overall = f"Loss of Rs {abs(net):.2f}"
+            overall = f"Loss of Rs {format_rupees(-net)}"
         else:
             overall = "No Profit or Loss"
 
         print("\n" + "-" * 120)
-        print(f"Total Sales : Rs {total_sales:.2f}")
-        print(f"Total Cost  : Rs {total_cost:.2f}")
-        print(f"Total GST   : Rs {total_gst_all:.2f}")
+        print(f"Total Sales : Rs {format_rupees(total_sales)}")
+        print(f"Total Cost  : Rs {format_rupees(total_cost)}")
+        print(f"Total GST   : Rs {format_rupees(total_gst_all)}")
         print(f"Profit/Loss : {overall}")
 
     except Exception as e:
@@ -783,9 +2050,44 @@ def view_sales_history(current_user):
     finally:
         pause()
 
+def view_stock_movements(current_user_id):
+    print("\n=== STOCK MOVEMENTS ===")
+    item_id_str = input("Item ID (blank for all items): ").strip()
+
+    try:
+        item_id = int(item_id_str) if item_id_str else None
+        start, end = ask_date_range()
+        start = start or "1970-01-01 00:00:00"
+        end = end or datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        print("Invalid item ID or date.")
+        pause()
+        return
+
+    if item_id is None:
+        rows = run_read_statement("movements_by_user", (current_user_id, start, end))
+    else:
+        rows = run_read_statement("movements_by_item", (current_user_id, item_id, start, end))
+
+    if not rows:
+        print("No movements in this range.")
+    else:
+        print(f"{'Entry':<8} {'Item ID':<8} {'Type':<12} {'Change':>10} {'When':<28}")
+        print("-" * 70)
+        for movement_id, mv_item_id, movement_type, qty_change, created_at in rows:
+            print(f"{movement_id:<8} {mv_item_id:<8} {movement_type:<12} {qty_change:>+10} {str(created_at):<28}")
+
+    if item_id is not None:
+        # The ledger is complete from the opening balance, so stock at any point is a range sum
+        stock = run_read_statement("stock_as_of", (current_user_id, item_id, end), fetch="one")[0]
+        print(f"\nStock of item {item_id} as of {end[:19]}: {stock}")
+
+    pause()
+
 def dashboard(current_user, current_user_id):
     while True:
         print("\n=== DASHBOARD ===")
+        print_summary_header(current_user_id)
         print("1. Add Supplier")
         print("2. Add Stock")
         print("3. View Stock")
@@ -795,8 +2097,11 @@ def dashboard(current_user, current_user_id):
         print("7. Generate Bill")
         print("8. Search Bills")
         print("9. Sales History")
-        print("10. Logout")
-        print("11. Exit")
+        print("10. Stock Movements")
+        print("11. Statement Stats")
+        print("12. Rebuild Dashboard Totals")
+        print("13. Logout")
+        print("14. Exit")
         choice = input("Choose an option: ").strip()
 
         if choice == "1":
@@ -818,12 +2123,17 @@ def dashboard(current_user, current_user_id):
         elif choice == "9":
             view_sales_history(current_user)
         elif choice == "10":
+            view_stock_movements(current_user_id)
+        elif choice == "11":
+            view_statement_stats()
+        elif choice == "12":
+            reconcile_summary(current_user, current_user_id)
+        elif choice == "13":
             print("Logging out...")
             break
-        elif choice == "11":
+        elif choice == "14":
             print("Exiting program...")
-            cursor.close()
-            conn.close()
+            close_connections()
             exit(0)
         else:
             print("Invalid choice.")
@@ -837,22 +2147,40 @@ def main():
         choice = input("Choose an option: ").strip()
 
         if choice == "1":
-            current_user, current_user_id = login_user()
+            login = login_user()
+            if not login:
+                continue
+            current_user, current_user_id = login
+            archive_closed_months(current_user)
+            try:
+                if not run_statement("summary_get", (current_user_id,), fetch="one"):
+                    rebuild_summary(current_user, current_user_id)
+            except mysql.connector.Error as e:
+                rollback()
+                print(f"Failed to build dashboard totals: {e}")
             dashboard(current_user, current_user_id)
         elif choice == "2":
             signup_user()
         elif choice == "3":
             print("Exiting program...")
-            cursor.close()
-            conn.close()
+            close_connections()
             exit(0)
         else:
             print("Invalid choice.")
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["changes"]:
+        changes_command(sys.argv[2:])
+        exit(0)
+
+    connect_as_root()
+    create_schema(cursor, conn)
+    manage_connection(conn, "inventory_db")
+    connect_replica()
+    start_compaction_worker()
+    start_change_sequencer()
     try:
         main()
     except KeyboardInterrupt:
         print("\nProgram interrupted by user. Exiting gracefully.")
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        close_connections()
\ No newline at end of file
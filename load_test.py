@@ -0,0 +1,388 @@
+"""Concurrent cashier load test for the billing path.
+
+Seeds a separate database with synthetic items and runs N cashier threads
+through the same checkout steps as generate_bill_txt: item selection,
+quantity validation, discount/GST, stock decrement and bill persistence.
+
+    python load_test.py --cashiers 16 --checkouts 200
+
+Cashiers of one user share that user's rows (see README, "Concurrency").
+Compare a run with --users 1 against --users equal to --cashiers: any
+difference in throughput and row lock waits is per-user serialization.
+"""
+import argparse
+import collections
+import csv
+import getpass
+import os
+import random
+import tempfile
+import threading
+import time
+
+import mysql.connector
+
+import I_M_S_CLI as ims
+
+DEADLOCK = 1213
+LOCK_WAIT_TIMEOUT = 1205
+LOAD_TEST_USER = "loadtest"
+
+
+def connect(args):
+    return ims.open_connection(
+        args.password,
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        database=args.database
+    )
+
+
+def load_test_username(number):
+    return LOAD_TEST_USER if number == 1 else f"{LOAD_TEST_USER}{number}"
+
+
+def seed(args):
+    """--users load-test users, each with one supplier and --items items of --stock units.
+
+    Returns a list of (username, user_id, item_ids).
+    """
+    connection = ims.open_connection(args.password, host=args.host, port=args.port, user=args.user)
+    db_cursor = connection.cursor()
+    ims.create_schema(db_cursor, connection, args.database)
+    ims.manage_connection(connection, args.database)
+
+    shops = [seed_user(args, connection, db_cursor, load_test_username(number))
+             for number in range(1, args.users + 1)]
+    connection.close()
+    return shops
+
+
+def seed_user(args, connection, db_cursor, username):
+    # Start from a clean slate for the load-test users only
+    db_cursor.execute("SELECT id FROM users WHERE username=%s", (username,))
+    row = db_cursor.fetchone()
+    if row:
+        user_id = row[0]
+        db_cursor.execute("DELETE FROM stock_movements WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM change_pending WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM change_log WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM change_seq WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM user_summary WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM inventory WHERE user_id=%s", (user_id,))
+        db_cursor.execute("DELETE FROM suppliers WHERE user_id=%s", (user_id,))
+    else:
+        user_id = ims.run_statement("user_insert", (username, "loadtest"), connection=connection).lastrowid
+
+    ims.run_statement("supplier_insert", (user_id, "Synthetic Supplier", "9999999999", "Nowhere"), connection=connection)
+    supplier_id = ims.run_statement("supplier_choices", (user_id,), fetch="all", connection=connection)[0][0]
+
+    slabs = sorted(ims.ALLOWED_GST_SLABS)
+    item_ids = []
+    for n in range(args.items):
+        price = round(random.uniform(10, 500), 2)
+        item_id = ims.run_statement(
+            "item_insert",
+            (user_id, supplier_id, f"Item {n + 1}", price, round(price * 0.7, 2), random.choice(slabs)),
+            connection=connection
+        ).lastrowid
+        ims.record_movement(user_id, item_id, "receipt", args.stock, connection=connection)
+        item_ids.append(item_id)
+    ims.commit(connection)
+    ims.rebuild_summary(username, user_id, connection=connection)
+    return username, user_id, item_ids
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.completed = 0
+        self.rejected = 0
+        self.rejected_at_commit = 0
+        self.deadlocks = 0
+        self.lock_waits = 0
+        self.errors = 0
+        self.sold = {}
+        self.bill_ids = []
+        self.bill_files = []
+
+    def record_sale(self, username, bill, bill_file, latency):
+        with self.lock:
+            self.completed += 1
+            self.latencies.append(latency)
+            self.bill_ids.append(bill["bill_id"])
+            self.bill_files.append((username, bill_file))
+            for item in bill["items"]:
+                self.sold[item["id"]] = self.sold.get(item["id"], 0) + item["qty"]
+
+
+def cashier(args, number, shop, results, start_gate):
+    username, user_id, item_ids = shop
+    try:
+        connection = connect(args)
+    except mysql.connector.Error:
+        # Release the other cashiers instead of leaving them at the gate
+        start_gate.abort()
+        raise
+    rng = random.Random()
+    start_gate.wait()
+
+    for _ in range(args.checkouts):
+        started = time.perf_counter()
+        try:
+            # Item selection and quantity validation against current stock
+            bill_items = []
+            for item_id in rng.sample(item_ids, min(args.lines, len(item_ids))):
+                row = ims.run_statement("item_for_bill", (item_id, user_id), fetch="one", connection=connection)
+                qty = rng.randint(1, args.max_qty)
+                if row and qty <= row[2]:
+                    bill_items.append(ims.make_bill_item(row, qty))
+            if not bill_items:
+                # End the read-only transaction so the next checkout sees fresh stock
+                ims.rollback(connection)
+                with results.lock:
+                    results.rejected += 1
+                continue
+
+            discount_bp = rng.choice([0, 0, 500, 1000, 1250])
+            totals = ims.compute_bill(bill_items, discount_bp)
+            # One customer name per cashier, so bill files name the cashier that wrote them
+            bill = ims.new_bill(f"Cashier{number}", "", "", bill_items, discount_bp, totals)
+            if ims.commit_sale(user_id, bill, connection=connection):
+                # Another cashier sold the stock between selection and commit
+                with results.lock:
+                    results.rejected_at_commit += 1
+                continue
+            bill_file = ims.save_bill(username, bill)
+            results.record_sale(username, bill, bill_file, time.perf_counter() - started)
+
+        except mysql.connector.Error as e:
+            ims.rollback(connection)
+            with results.lock:
+                if e.errno == DEADLOCK:
+                    results.deadlocks += 1
+                elif e.errno == LOCK_WAIT_TIMEOUT:
+                    results.lock_waits += 1
+                else:
+                    results.errors += 1
+
+    connection.close()
+
+
+def background(args, stop, step, batch_size, interval):
+    """Stand-in for the app's worker threads: run step in full batches every interval seconds."""
+    connection = ims.open_connection(
+        args.password,
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        database=args.database,
+        isolation="READ COMMITTED"
+    )
+    while not stop.wait(interval):
+        try:
+            while step(connection) == batch_size:
+                pass
+        except mysql.connector.Error:
+            pass
+    # Last round after the cashiers are done, so the change feed is complete
+    while step(connection) == batch_size:
+        pass
+    connection.close()
+
+
+def row_lock_status(args):
+    """Server-wide InnoDB row lock counters: (waits, total wait ms)."""
+    connection = connect(args)
+    status_cursor = connection.cursor()
+    status_cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%'")
+    status = dict(status_cursor.fetchall())
+    status_cursor.close()
+    connection.close()
+    return int(status["Innodb_row_lock_waits"]), int(status["Innodb_row_lock_time"])
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def check_anomalies(args, shops, results):
+    connection = connect(args)
+    rows = []
+    for _, user_id, _ in shops:
+        rows.extend(ims.run_statement("stock_list", (user_id,), fetch="all", connection=connection))
+    connection.close()
+
+    negative = [(item_id, qty) for item_id, _, qty, *_ in rows if qty < 0]
+    oversold = [(item_id, sold) for item_id, sold in results.sold.items() if sold > args.stock]
+    # The ledger must account for every unit the cashiers believe they sold
+    drift = [
+        (item_id, args.stock - qty, results.sold.get(item_id, 0))
+        for item_id, _, qty, *_ in rows
+        if args.stock - qty != results.sold.get(item_id, 0)
+    ]
+
+    # Every completed checkout must leave exactly one bill file behind
+    duplicate_ids = [bill_id for bill_id, count in collections.Counter(results.bill_ids).items() if count > 1]
+    duplicate_files = [
+        os.path.join(username, name)
+        for (username, name), count in collections.Counter(results.bill_files).items() if count > 1
+    ]
+    on_disk = {
+        (username, name)
+        for username, _, _ in shops
+        for name in os.listdir(ims.ensure_user_folder(username)) if name.endswith(".txt")
+    }
+    missing_files = sorted(os.path.join(username, name) for username, name in set(results.bill_files) - on_disk)
+
+    # Each bill must reach the change feed once, and seqs must run 1..n without gaps
+    feed_problems = []
+    bills_by_user = collections.Counter(username for username, _ in results.bill_files)
+    connection = connect(args)
+    feed_cursor = connection.cursor()
+    for username, user_id, _ in shops:
+        feed_cursor.execute(
+            "SELECT COUNT(*), COALESCE(MAX(seq), 0), COALESCE(SUM(entity = 'bill'), 0) "
+            "FROM change_log WHERE user_id=%s",
+            (user_id,)
+        )
+        events, last_seq, bill_events = feed_cursor.fetchone()
+        if events != last_seq:
+            feed_problems.append(f"{username}: {events} events but last seq {last_seq}")
+        if bill_events != bills_by_user[username]:
+            feed_problems.append(f"{username}: {bill_events} bill events for {bills_by_user[username]} bills")
+    feed_cursor.close()
+    connection.close()
+    return negative, oversold, drift, duplicate_ids, duplicate_files, missing_files, feed_problems
+
+
+def report(args, results, elapsed, row_locks, anomalies):
+    latencies = sorted(results.latencies)
+    negative, oversold, drift, duplicate_ids, duplicate_files, missing_files, feed_problems = anomalies
+    lock_waits, lock_time_ms = row_locks
+
+    print("\n=== LOAD TEST RESULTS ===")
+    print(f"Cashiers            : {args.cashiers}")
+    print(f"Users               : {args.users}")
+    print(f"Checkouts attempted : {args.cashiers * args.checkouts}")
+    print(f"Completed           : {results.completed}")
+    print(f"Rejected (no stock) : {results.rejected}")
+    print(f"Rejected at commit  : {results.rejected_at_commit}")
+    print(f"Deadlocks           : {results.deadlocks}")
+    print(f"Lock wait timeouts  : {results.lock_waits}")
+    print(f"Other DB errors     : {results.errors}")
+    print(f"Elapsed             : {elapsed:.2f} s")
+    print(f"Throughput          : {results.completed / elapsed if elapsed else 0:.1f} checkouts/s")
+    print(f"Latency p50         : {percentile(latencies, 50) * 1000:.2f} ms")
+    print(f"Latency p95         : {percentile(latencies, 95) * 1000:.2f} ms")
+    print(f"Latency p99         : {percentile(latencies, 99) * 1000:.2f} ms")
+    # Server-wide counters: anything else running on this mysqld is included
+    print(f"Row lock waits      : {lock_waits}")
+    print(f"Row lock wait time  : {lock_time_ms} ms"
+          + (f" ({lock_time_ms / lock_waits:.1f} ms avg)" if lock_waits else ""))
+
+    print("\n--- Anomalies ---")
+    print(f"Negative stock items : {len(negative)}")
+    for item_id, qty in negative:
+        print(f"  item {item_id}: stock {qty}")
+    print(f"Oversold items       : {len(oversold)}")
+    for item_id, sold in oversold:
+        print(f"  item {item_id}: sold {sold} of {args.stock}")
+    print(f"Ledger mismatches    : {len(drift)}")
+    for item_id, ledger_sold, counted_sold in drift:
+        print(f"  item {item_id}: ledger says {ledger_sold} sold, cashiers counted {counted_sold}")
+    print(f"Duplicate bill IDs   : {len(duplicate_ids)}")
+    for bill_id in duplicate_ids:
+        print(f"  bill {bill_id}")
+    print(f"Duplicate bill files : {len(duplicate_files)}")
+    for name in duplicate_files:
+        print(f"  {name}")
+    print(f"Missing bill files   : {len(missing_files)}")
+    for name in missing_files:
+        print(f"  {name}")
+    print(f"Change feed problems : {len(feed_problems)}")
+    for problem in feed_problems:
+        print(f"  {problem}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent cashiers against a local MySQL.")
+    parser.add_argument("--cashiers", type=int, default=8, help="concurrent cashier threads")
+    parser.add_argument("--checkouts", type=int, default=100, help="checkouts per cashier")
+    parser.add_argument("--users", type=int, default=1,
+                        help="load-test users (shops) the cashiers are spread over")
+    parser.add_argument("--items", type=int, default=20, help="synthetic items to seed")
+    parser.add_argument("--stock", type=int, default=500, help="starting stock per item")
+    parser.add_argument("--lines", type=int, default=3, help="items per bill")
+    parser.add_argument("--max-qty", type=int, default=5, help="largest quantity per line")
+    parser.add_argument("--compact-every", type=float, default=1.0,
+                        help="seconds between ledger compactions during the run (0 to disable)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", help="MySQL password (prompted if omitted)")
+    parser.add_argument("--database", default="inventory_loadtest",
+                        help="database to seed; never point this at inventory_db")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+    if args.password is None:
+        args.password = getpass.getpass("MySQL password: ")
+
+    # Bills go to a throwaway folder, not the real users_data
+    ims.users_data_dir = tempfile.mkdtemp(prefix="ims_loadtest_")
+    # Header up front so concurrent first bills don't each write one
+    for number in range(1, args.users + 1):
+        csv_path = os.path.join(ims.ensure_user_folder(load_test_username(number)), "bill_history.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(ims.SALES_CSV_HEADER)
+
+    shops = seed(args)
+    print(f"Seeded {args.users} user(s) x {args.items} items x {args.stock} units in {args.database}; "
+          f"bills in {ims.users_data_dir}")
+
+    results = Results()
+    start_gate = threading.Barrier(args.cashiers + 1)
+    workers = [
+        threading.Thread(target=cashier, args=(args, number, shops[(number - 1) % len(shops)], results, start_gate))
+        for number in range(1, args.cashiers + 1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stop = threading.Event()
+    helpers = [threading.Thread(
+        target=background,
+        args=(args, stop, ims.sequence_changes, ims.CHANGE_SEQUENCE_BATCH_SIZE, ims.CHANGE_SEQUENCE_INTERVAL_SECONDS)
+    )]
+    if args.compact_every > 0:
+        helpers.append(threading.Thread(
+            target=background,
+            args=(args, stop, ims.compact_stock_ledger, ims.COMPACTION_BATCH_SIZE, args.compact_every)
+        ))
+    for helper in helpers:
+        helper.start()
+
+    locks_before = row_lock_status(args)
+    start_gate.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for helper in helpers:
+        helper.join()
+
+    locks_after = row_lock_status(args)
+    row_locks = (locks_after[0] - locks_before[0], locks_after[1] - locks_before[1])
+    report(args, results, elapsed, row_locks, check_anomalies(args, shops, results))
+
+
+if __name__ == "__main__":
+    main()